@@ -1,74 +1,225 @@
+import asyncio
+import atexit
+import logging
 import time
+from collections.abc import Collection
+from datetime import UTC, datetime, timedelta
 
 import httpx
+import msgspec
 import schedule
 import structlog
 
-from noaa_notifier.data import MesoscaleDiscussion
+from noaa_notifier.data import (
+    MapServerQueryResponse,
+    MesoscaleDiscussion,
+    md_id_from_mapserver_json,
+)
 from noaa_notifier.db import DatabaseHandler
 
 logger = structlog.get_logger()
 
 MD_URL: str = "https://mapservices.weather.noaa.gov/vector/rest/services/outlooks/spc_mesoscale_discussion"
-MAPSERVER_QUERY_SUFFIX: str = "/MapServer/0/query?where=1%3D1&outFields=*&f=json"
+MAPSERVER_QUERY_SUFFIX: str = (
+    "/MapServer/0/query?where=1%3D1&outFields=name%2Cpopupinfo&f=json"
+)
+MD_QUERY_URL: str = MD_URL + MAPSERVER_QUERY_SUFFIX
+MD_RETENTION: timedelta = timedelta(days=30)
 DISCORD_WEBHOOK_URL: str = "https://discord.com/api/webhooks/1253666120813117460/3YfZNBfIxc_ETSMguKFWgmdJ5s73fprYRwSOGrX31n2YGe4N_ctmDxgdlHa_kxgfjjDw"
 
 
-def get_mds_from_noaa() -> set[MesoscaleDiscussion]:
-    """Returns a list of mesoscale discussions."""
-    logger.info("Getting Mesoscale Discussions from NOAA map service")
-    response = httpx.get(MD_URL + MAPSERVER_QUERY_SUFFIX)
+HTTP_TIMEOUT: float = 30.0
+USER_AGENT: str = "noaa-notifier"
+DISCORD_EMBED_DESCRIPTION_LIMIT: int = 4096
+
+# Shared across polls so the NOAA connection stays alive between cycles
+_http_client = httpx.Client(
+    http2=True,
+    timeout=HTTP_TIMEOUT,
+    headers={"User-Agent": USER_AGENT},
+)
+atexit.register(_http_client.close)
+
+_query_decoder = msgspec.json.Decoder(MapServerQueryResponse)
+
+# Validators from the last MapServer response, replayed as a conditional GET
+_conditional_headers: dict[str, str] = {}
+
+
+def get_mds_from_noaa(
+    client: httpx.Client = _http_client,
+    conditional_headers: dict[str, str] = _conditional_headers,
+) -> dict[int, MesoscaleDiscussion] | None:
+    """Returns active MDs keyed by MD number, or None if unchanged.
+
+    Malformed features are logged and skipped. Validators from each 200
+    response are stored in conditional_headers once its body has decoded,
+    and replayed on the next call.
+    """
+    logger.debug("Getting Mesoscale Discussions from NOAA map service")
+    response = client.get(MD_QUERY_URL, headers=conditional_headers)
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        return None
     response.raise_for_status()
-    if response.json()["features"]:
-        wx_products: set[MesoscaleDiscussion | None] = {
-            MesoscaleDiscussion.from_mapserver_json(md)
-            for md in response.json()["features"]
-        }
-        return {wx_product for wx_product in wx_products if wx_product}  # Filter Nones
-    return set()
 
+    mds: dict[int, MesoscaleDiscussion] = {}
+    for feature in _query_decoder.decode(response.content).features:
+        try:
+            md_id = md_id_from_mapserver_json(feature)
+            if md_id is None:  # Filter NoArea placeholders
+                continue
+            mds[md_id] = MesoscaleDiscussion.from_mapserver_json(md_id, feature)
+        except ValueError as e:
+            logger.warning(
+                "Skipping malformed MD feature",
+                name=feature.attributes.name,
+                error=str(e),
+            )
 
-def notify_discord(
+    # Saved last, so a body that failed to decode isn't hidden behind a 304
+    if etag := response.headers.get("ETag"):
+        conditional_headers["If-None-Match"] = etag
+    if last_modified := response.headers.get("Last-Modified"):
+        conditional_headers["If-Modified-Since"] = last_modified
+    return mds
+
+
+async def notify_discord(
     md: MesoscaleDiscussion,
+    client: httpx.AsyncClient,
     webhook_url: str = DISCORD_WEBHOOK_URL,
 ) -> int:
     """Notifies Discord of a new mesoscale discussion."""
     logger.info("Notifying Discord of new MD", md_id=md.id)
-    result = httpx.post(
+    text = await md.get_text(client)
+    payload = {
+        "content": f"New Mesoscale Discussion: {md.id}",
+        "embeds": [
+            {
+                "title": f"Mesoscale Discussion {md.id}",
+                "url": md.info_page,
+                "description": text[:DISCORD_EMBED_DESCRIPTION_LIMIT],
+            },
+        ],
+    }
+    result = await client.post(
         webhook_url,
-        json={
-            "content": f"New Mesoscale Discussion: {md.id}",
-            "embeds": [
-                {
-                    "title": f"Mesoscale Discussion {md.id}",
-                    "url": md.info_page,
-                    "description": md.get_text(),
-                },
-            ],
-        },
+        content=msgspec.json.encode(payload),
+        headers={"Content-Type": "application/json"},
     )
     result.raise_for_status()
     return result.status_code
 
 
-def main() -> None:
-    db = DatabaseHandler("mesoscale_discussions.db")
-    new_mds = {md for md in get_mds_from_noaa() if md not in db.get_mds()}
-    for md in new_mds:
-        logger.info("New Mesoscale Discussion", md_id=md.id, info_page=md.info_page)
-        db.add_md(md)
-        notify_discord(md)
+def _is_transient(error: Exception) -> bool:
+    """Returns whether a failed notification is worth retrying next cycle."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return (
+            status_code == httpx.codes.TOO_MANY_REQUESTS
+            or status_code >= httpx.codes.INTERNAL_SERVER_ERROR
+        )
+    # A malformed URL won't fix itself; timeouts and dropped connections might
+    return isinstance(error, httpx.TransportError) and not isinstance(
+        error,
+        httpx.UnsupportedProtocol,
+    )
+
 
+async def notify_discord_all(
+    mds: Collection[MesoscaleDiscussion],
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> list[MesoscaleDiscussion]:
+    """Notifies Discord of several mesoscale discussions concurrently.
+
+    Returns the discussions that failed transiently and should be retried.
+    Permanent failures are logged and dropped.
+    """
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=HTTP_TIMEOUT,
+        headers={"User-Agent": USER_AGENT},
+        limits=httpx.Limits(max_keepalive_connections=32),
+        transport=transport,
+    ) as client:
+        results = await asyncio.gather(
+            *(notify_discord(md, client) for md in mds),
+            return_exceptions=True,
+        )
+    retry: list[MesoscaleDiscussion] = []
+    for md, result in zip(mds, results, strict=True):
+        if isinstance(result, Exception):
+            transient = _is_transient(result)
+            # Not str(result): httpx errors include the webhook URL and its token
+            status_code = (
+                result.response.status_code
+                if isinstance(result, httpx.HTTPStatusError)
+                else None
+            )
+            logger.error(
+                "Failed to notify Discord",
+                md_id=md.id,
+                error=type(result).__name__,
+                status_code=status_code,
+                retrying=transient,
+            )
+            if transient:
+                retry.append(md)
+    return retry
+
+
+def main(
+    db: DatabaseHandler,
+    client: httpx.Client = _http_client,
+    conditional_headers: dict[str, str] = _conditional_headers,
+    discord_transport: httpx.AsyncBaseTransport | None = None,
+) -> None:
+    mds = get_mds_from_noaa(client, conditional_headers)
+    if mds is None:
+        logger.debug("MDs unchanged since last check")
+        return
+    if not mds:
+        logger.debug("No active MDs found")
+        return
+
+    new_ids = mds.keys() - db.get_existing_md_ids(mds.keys())
+    new_mds: dict[int, MesoscaleDiscussion] = {md_id: mds[md_id] for md_id in new_ids}
     if not new_mds:
-        logger.info("No new MDs found")
+        logger.debug("No new MDs found")
+        return
+
+    for md in new_mds.values():
+        logger.info("New Mesoscale Discussion", md_id=md.id, info_page=md.info_page)
+
+    # Leave transient failures unrecorded so they are retried next cycle
+    retry = asyncio.run(notify_discord_all(new_mds.values(), discord_transport))
+    retry_ids = {md.id for md in retry}
+    settled = [md for md_id, md in new_mds.items() if md_id not in retry_ids]
+    db.add_mds(settled)
+    if settled and (
+        pruned := db.delete_mds_seen_before(datetime.now(tz=UTC) - MD_RETENTION)
+    ):
+        logger.info("Pruned old MDs", count=pruned)
+    if retry:
+        # Force a full fetch next time; a 304 would otherwise hide the retries
+        conditional_headers.clear()
 
 
 if __name__ == "__main__":
+    # Drop debug calls at the bound-logger level instead of formatting them
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
+    )
+
+    db = DatabaseHandler("mesoscale_discussions.db")
+
     # Run every minute
     logger.info("Starting notifier scheduler")
-    schedule.every().minute.do(main)
+    schedule.every().minute.do(main, db)
 
-    main()
+    main(db)
     while True:
+        # Sleep until the next job is due rather than waking every second
+        idle_seconds = schedule.idle_seconds()
+        time.sleep(idle_seconds if idle_seconds and idle_seconds > 0 else 1)
         schedule.run_pending()
-        time.sleep(1)
@@ -1,28 +1,74 @@
+import html
+import re
 from datetime import UTC, datetime
 from typing import Self
 
 import httpx
-from lxml import html
-from pydantic import BaseModel
+import msgspec
 
+# MD pages carry the discussion in a single, simple <pre> block
+PRE_REGEX = re.compile(r"<pre[^>]*>(.*?)</pre>", re.DOTALL | re.IGNORECASE)
+TAG_REGEX = re.compile(r"<[^>]+>")
 
-class MesoscaleDiscussion(BaseModel):
+
+def _force_https(url: str) -> str:
+    """Upgrades an http:// URL to https://, leaving anything else untouched."""
+    if url.startswith("http://"):
+        return "https://" + url.removeprefix("http://")
+    return url
+
+
+class MapServerAttributes(msgspec.Struct):
+    """Attributes of a NOAA ESRI map server feature."""
+
+    name: str
+    popupinfo: str | None
+
+
+class MapServerFeature(msgspec.Struct):
+    """A single feature of a NOAA ESRI map server query."""
+
+    attributes: MapServerAttributes
+    geometry: dict | None = None
+
+
+class MapServerQueryResponse(msgspec.Struct):
+    """NOAA ESRI map server query response, decoded to the fields we use."""
+
+    features: list[MapServerFeature]
+
+
+def md_id_from_mapserver_json(data: MapServerFeature) -> int | None:
+    """Gets the MD number of a NOAA ESRI map server feature, or None for NoArea."""
+    name = data.attributes.name
+    if name == "NoArea":
+        return None
+    return int(name.removeprefix("MD "))
+
+
+class MesoscaleDiscussion(msgspec.Struct, frozen=True):
     """Weather product data."""
 
     id: int
     info_page: str
     geometry: dict
-    first_seen: datetime = datetime.now(tz=UTC)
+    first_seen: datetime = msgspec.field(default_factory=lambda: datetime.now(tz=UTC))
 
     @classmethod
-    def from_mapserver_json(cls, data: dict) -> Self | None:
-        """Create a new MesoscaleDiscussion from NOAA ESRI map server JSON data."""
-        if data["attributes"]["name"] == "NoArea":
-            return None
+    def from_mapserver_json(cls, md_id: int, data: MapServerFeature) -> Self:
+        """Create a new MesoscaleDiscussion from NOAA ESRI map server JSON data.
+
+        md_id is the number already parsed by md_id_from_mapserver_json, so
+        NoArea placeholders must be filtered out before calling this.
+        """
+        # Only NoArea placeholders may leave these empty
+        if data.attributes.popupinfo is None or data.geometry is None:
+            msg = f"MD {md_id} is missing its info page or geometry"
+            raise ValueError(msg)
         return cls(
-            id=int(data["attributes"]["name"].replace("MD ", "")),
-            info_page=data["attributes"]["popupinfo"].replace("http", "https"),
-            geometry=data["geometry"],
+            id=md_id,
+            info_page=_force_https(data.attributes.popupinfo),
+            geometry=data.geometry,
         )
 
     def __hash__(self) -> int:
@@ -33,11 +79,13 @@ class MesoscaleDiscussion(BaseModel):
             return NotImplemented
         return self.id == other.id
 
-    def get_text(self) -> str:
+    async def get_text(self, client: httpx.AsyncClient) -> str:
         """Gets discussion text from html."""
-        response = httpx.get(self.info_page)
+        response = await client.get(self.info_page)
         response.raise_for_status()
 
-        tree = html.fromstring(response.text)
-        elements = tree.xpath("//pre")
-        return elements[0].text_content()
+        match = PRE_REGEX.search(response.text)
+        if match is None:
+            msg = f"No discussion text found at {self.info_page}"
+            raise ValueError(msg)
+        return html.unescape(TAG_REGEX.sub("", match.group(1)))
@@ -1,7 +1,9 @@
-import json
 import sqlite3
+from collections.abc import Collection, Iterable
 from datetime import datetime
 
+import msgspec
+
 from noaa_notifier.data import MesoscaleDiscussion
 
 
@@ -9,6 +11,10 @@ class DatabaseHandler:
     def __init__(self, db_name: str) -> None:
         """Initializes the database connection and creates the table if it doesn't exist."""
         self.conn = sqlite3.connect(db_name)
+        # WAL appends each commit to a log instead of writing a rollback journal
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
         self.cursor = self.conn.cursor()
         self.create_table()
 
@@ -27,33 +33,61 @@ class DatabaseHandler:
         self.conn.commit()
 
     def add_md(self, md: MesoscaleDiscussion) -> None:
-        data: dict = md.model_dump(mode="json")
+        self.add_mds([md])
 
-        data["geometry"] = json.dumps(
-            data["geometry"]
-        )  # Convert geometry to JSON string
-        data["first_seen"] = data["first_seen"]
-        self.cursor.execute(
+    def add_mds(self, mds: Iterable[MesoscaleDiscussion]) -> None:
+        """Stores several discussions in a single transaction."""
+        rows = [
+            {
+                "id": md.id,
+                "info_page": md.info_page,
+                # Store geometry as a JSON string
+                "geometry": msgspec.json.encode(md.geometry).decode(),
+                "first_seen": md.first_seen.isoformat(),
+            }
+            for md in mds
+        ]
+        self.cursor.executemany(
             """
-            INSERT OR REPLACE INTO MesoscaleDiscussion (id, info_page, geometry, first_seen)
+            INSERT OR IGNORE INTO MesoscaleDiscussion (id, info_page, geometry, first_seen)
             VALUES (:id, :info_page, :geometry, :first_seen)
             """,
-            data,
+            rows,
+        )
+        self.conn.commit()
+
+    def delete_mds_seen_before(self, cutoff: datetime) -> int:
+        """Deletes discussions first seen before the cutoff and returns the count."""
+        self.cursor.execute(
+            "DELETE FROM MesoscaleDiscussion WHERE first_seen < ?",
+            (cutoff.isoformat(),),
         )
         self.conn.commit()
+        return self.cursor.rowcount
+
+    def get_existing_md_ids(self, ids: Collection[int]) -> set[int]:
+        """Returns which of the given ids are already stored."""
+        if not ids:
+            return set()
+        placeholders = ",".join("?" * len(ids))
+        self.cursor.execute(
+            f"SELECT id FROM MesoscaleDiscussion WHERE id IN ({placeholders})",  # noqa: S608
+            tuple(ids),
+        )
+        return {row[0] for row in self.cursor.fetchall()}
 
-    def get_mds(self) -> set[MesoscaleDiscussion]:
+    def get_mds(self) -> dict[int, MesoscaleDiscussion]:
         self.cursor.execute("SELECT * FROM MesoscaleDiscussion")
         rows = self.cursor.fetchall()
-        discussions: set[MesoscaleDiscussion] = set()
+        discussions: dict[int, MesoscaleDiscussion] = {}
         for row in rows:
             data = {
                 "id": row[0],
                 "info_page": row[1],
-                "geometry": json.loads(row[2]),
+                "geometry": msgspec.json.decode(row[2]),
                 "first_seen": datetime.fromisoformat(row[3]),
             }
-            discussions.add(MesoscaleDiscussion(**data))
+            discussions[row[0]] = MesoscaleDiscussion(**data)
         return discussions
 
     def close(self) -> None:
@@ -0,0 +1,38 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from noaa_notifier.data import MesoscaleDiscussion
+from noaa_notifier.db import DatabaseHandler
+
+
+@pytest.fixture()
+def db() -> DatabaseHandler:
+    return DatabaseHandler(":memory:")
+
+
+def make_md(md_id: int, first_seen: datetime) -> MesoscaleDiscussion:
+    return MesoscaleDiscussion(
+        id=md_id,
+        info_page=f"https://www.spc.noaa.gov/products/md/md{md_id:04}.html",
+        geometry={"type": "Point", "coordinates": [-94.5, 38.5]},
+        first_seen=first_seen,
+    )
+
+
+def test_delete_mds_seen_before(db: DatabaseHandler) -> None:
+    now = datetime.now(tz=UTC)
+    db.add_md(make_md(1, now - timedelta(days=40)))
+    db.add_md(make_md(2, now))
+
+    deleted: int = db.delete_mds_seen_before(now - timedelta(days=30))
+
+    assert deleted == 1
+    assert db.get_existing_md_ids({1, 2}) == {2}
+
+
+def test_get_existing_md_ids(db: DatabaseHandler) -> None:
+    db.add_md(make_md(1, datetime.now(tz=UTC)))
+
+    assert db.get_existing_md_ids({1, 2, 3}) == {1}
+    assert db.get_existing_md_ids(set()) == set()
@@ -1,9 +1,15 @@
+import asyncio
+
+import httpx
 import pytest
 
 from noaa_notifier.app import (
     MesoscaleDiscussion,
+    get_mds_from_noaa,
+    main,
     notify_discord,
 )
+from noaa_notifier.db import DatabaseHandler
 
 TEST_WEBHOOK_URL = "https://discord.com/api/webhooks/1253666695667519540/wr44A-qYHt98mCLB8iuDUBfIIEipO0vyUcVXOeiXkn1H1x1VkS4sstB7u2ZW_gGca2U2"
 
@@ -17,7 +23,132 @@ def test_md() -> MesoscaleDiscussion:
     )
 
 
+async def _notify_discord(md: MesoscaleDiscussion) -> int:
+    async with httpx.AsyncClient() as client:
+        return await notify_discord(md, client, TEST_WEBHOOK_URL)
+
+
 def test_notify_discord(test_md: MesoscaleDiscussion) -> None:
-    status_code: int = notify_discord(test_md, TEST_WEBHOOK_URL)
+    status_code: int = asyncio.run(_notify_discord(test_md))
     expected_status_code: int = 204
     assert status_code == expected_status_code
+
+
+def test_get_text(test_md: MesoscaleDiscussion) -> None:
+    page = (
+        "<html><body><center><img src='mcd0001.png'></center>"
+        "<pre>\n   Mesoscale Discussion 0001\n"
+        "   Areas affected...<a href='/'>Kansas</a> &amp; Nebraska\n</pre>"
+        "</body></html>"
+    )
+
+    async def get_text() -> str:
+        transport = httpx.MockTransport(lambda _: httpx.Response(200, text=page))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await test_md.get_text(client)
+
+    assert asyncio.run(get_text()) == (
+        "\n   Mesoscale Discussion 0001\n   Areas affected...Kansas & Nebraska\n"
+    )
+
+
+MD_QUERY_BODY = {
+    "features": [
+        {
+            "attributes": {
+                "name": "MD 1",
+                "popupinfo": "http://www.spc.noaa.gov/products/md/md0001.html",
+            },
+            "geometry": {"rings": [[[-94.5, 38.5], [-94.0, 38.5], [-94.5, 38.0]]]},
+        },
+        {"attributes": {"name": "NoArea", "popupinfo": None}, "geometry": None},
+    ],
+}
+
+
+def test_get_mds_from_noaa_conditional_get() -> None:
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(
+            200,
+            json=MD_QUERY_BODY,
+            headers={"ETag": '"v1"', "Last-Modified": "Mon, 24 Jun 2024 22:00:00 GMT"},
+        )
+
+    conditional_headers: dict[str, str] = {}
+    with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+        mds = get_mds_from_noaa(client, conditional_headers)
+        assert mds is not None
+        assert mds.keys() == {1}
+        assert conditional_headers == {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Mon, 24 Jun 2024 22:00:00 GMT",
+        }
+
+        assert get_mds_from_noaa(client, conditional_headers) is None
+
+    assert "If-None-Match" not in requests[0].headers
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+    assert requests[1].headers["If-Modified-Since"] == "Mon, 24 Jun 2024 22:00:00 GMT"
+
+
+MD_PAGE = "<html><body><pre>\n   Mesoscale Discussion 0001\n</pre></body></html>"
+
+
+def _run_main(webhook_status: int) -> tuple[DatabaseHandler, dict[str, str]]:
+    def noaa_handler(_: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=MD_QUERY_BODY, headers={"ETag": '"v1"'})
+
+    def discord_handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            return httpx.Response(200, text=MD_PAGE)
+        return httpx.Response(webhook_status)
+
+    db = DatabaseHandler(":memory:")
+    conditional_headers: dict[str, str] = {}
+    with httpx.Client(transport=httpx.MockTransport(noaa_handler)) as client:
+        main(
+            db,
+            client,
+            conditional_headers,
+            discord_transport=httpx.MockTransport(discord_handler),
+        )
+    return db, conditional_headers
+
+
+def test_main_retries_transient_failures() -> None:
+    db, conditional_headers = _run_main(webhook_status=503)
+
+    assert db.get_existing_md_ids({1}) == set()
+    assert conditional_headers == {}
+
+
+def test_main_records_permanent_failures() -> None:
+    db, conditional_headers = _run_main(webhook_status=400)
+
+    assert db.get_existing_md_ids({1}) == {1}
+    assert conditional_headers == {"If-None-Match": '"v1"'}
+
+
+def test_get_mds_from_noaa_skips_malformed_features() -> None:
+    body = {
+        "features": [
+            *MD_QUERY_BODY["features"],
+            {"attributes": {"name": "MD 2", "popupinfo": None}, "geometry": None},
+        ],
+    }
+
+    def handler(_: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=body, headers={"ETag": '"v1"'})
+
+    conditional_headers: dict[str, str] = {}
+    with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+        mds = get_mds_from_noaa(client, conditional_headers)
+
+    assert mds is not None
+    assert mds.keys() == {1}
+    assert conditional_headers == {"If-None-Match": '"v1"'}